@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Circuit Breaker - Stops hammering source feeds while they are down
+
+import random
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# All breakers created in this process, by name, so their state can be inspected
+BREAKERS = {}
+
+
+def backoff_delay(attempt, base_delay, max_delay, jitter=0.5):
+    """Return a jittered exponential delay in seconds for the given attempt (1-based).
+
+    The delay doubles with every attempt up to max_delay, then a random share of
+    up to `jitter` is taken off so that sources failing together do not retry in
+    lockstep.
+    """
+    delay = min(max_delay, base_delay * (2 ** max(0, attempt - 1)))
+    return delay * random.uniform(1 - jitter, 1)
+
+
+class CircuitBreaker:
+    """Per-source circuit breaker with jittered exponential backoff.
+
+    Closed: requests go through. After `failure_threshold` consecutive failures
+    the breaker opens and requests are refused until the backoff expires. Then a
+    single half-open probe is let through: success closes the breaker, failure
+    opens it again with a longer backoff.
+    """
+
+    def __init__(self, name, failure_threshold=3, base_delay=30, max_delay=600, jitter=0.5):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.state = CLOSED
+        self.failures = 0  # Consecutive failures
+        self.trips = 0  # Consecutive times the breaker opened without recovering
+        self.open_until = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+        BREAKERS[name] = self
+
+    def allow_request(self):
+        """Return True if a request to the source may be made now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() < self.open_until:
+                    return False
+                self._set_state(HALF_OPEN)
+            # Half-open: only one probe at a time
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record_success(self):
+        """Record a successful request and close the breaker."""
+        with self._lock:
+            self.failures = 0
+            self.trips = 0
+            self.probe_in_flight = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        """Record a failed request, opening the breaker if needed."""
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.trips += 1
+                delay = backoff_delay(self.trips, self.base_delay, self.max_delay, self.jitter)
+                self.open_until = time.monotonic() + delay
+                self._set_state(OPEN, f"retry in {delay:.0f}s")
+
+    def time_until_retry(self):
+        """Return the seconds until the next request is allowed (0 if allowed now)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.open_until - time.monotonic())
+
+    def snapshot(self):
+        """Return the breaker state as a plain dict."""
+        return {
+            'name': self.name,
+            'state': self.state,
+            'failures': self.failures,
+            'trips': self.trips,
+            'retry_in': round(self.time_until_retry(), 1),
+        }
+
+    def _set_state(self, state, detail=None):
+        self.state = state
+        suffix = f" ({detail})" if detail else ""
+        print(f"\n[{self.name}] Circuit {state}{suffix}")
+
+
+def breaker_states():
+    """Return snapshots of all breakers in this process."""
+    return [breaker.snapshot() for breaker in BREAKERS.values()]
+
+
+def print_breaker_states():
+    """Print how many breakers are in each state and list those not closed."""
+    states = breaker_states()
+    if not states:
+        return
+    counts = {state: sum(1 for entry in states if entry['state'] == state) for state in (CLOSED, OPEN, HALF_OPEN)}
+    print(f"\nCircuit breakers: {counts[CLOSED]} closed, {counts[OPEN]} open, {counts[HALF_OPEN]} half-open")
+    for entry in states:
+        if entry['state'] != CLOSED:
+            print(f"- {entry['name']}: {entry['state']}, {entry['failures']} failures, "
+                  f"{entry['trips']} trips, retry in {entry['retry_in']:.0f}s")
+
+
+def log_states_every(seconds):
+    """Print breaker states every few seconds in the background."""
+    def run():
+        while True:
+            time.sleep(seconds)
+            print_breaker_states()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def add_arguments(parser):
+    """Add the --breaker-stats option to a tracker's argument parser."""
+    parser.add_argument('--breaker-stats', type=float, metavar='SECONDS',
+                        help="Print circuit breaker states every SECONDS")
+
+
+def start_from_args(args):
+    """Start printing breaker states if --breaker-stats was given."""
+    if args.breaker_stats:
+        log_states_every(args.breaker_stats)
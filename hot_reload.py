@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# Hot Reload - Applies config and credential file changes to a running tracker
+
+import json
+import os
+import threading
+import time
+
+DEFAULT_CHECK_INTERVAL = 2  # Seconds between file checks when watching in the background
+
+
+def file_signature(path):
+    """Return what identifies a file version (mtime and size), or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_json(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class ConfigWatcher:
+    """Watches files and hands their new contents to a callback when they change.
+
+    Each file is checked with a single stat call, so check() is cheap enough
+    to run on every loop iteration. A file that fails to load or apply is
+    reported and the running configuration is kept.
+    """
+
+    def __init__(self):
+        self.watches = []  # [path, loader, callback, signature]
+        self.lock = threading.Lock()
+        self.running = False
+
+    def watch(self, path, callback, loader=load_json):
+        """Call callback(loader(path)) whenever the file changes from now on."""
+        with self.lock:
+            self.watches.append([path, loader, callback, file_signature(path)])
+
+    def check(self):
+        """Apply every file that changed since the last check."""
+        with self.lock:
+            changed = []
+            for watch in self.watches:
+                signature = file_signature(watch[0])
+                if signature != watch[3]:
+                    watch[3] = signature
+                    if signature is not None:
+                        changed.append(watch)
+
+        for path, loader, callback, _ in changed:
+            try:
+                callback(loader(path))
+                print(f"\nReloaded {os.path.basename(path)}")
+            except Exception as e:
+                print(f"\nError reloading {os.path.basename(path)}, keeping current settings: {e}")
+
+    def start(self, interval=DEFAULT_CHECK_INTERVAL):
+        """Check the files in the background."""
+        self.running = True
+
+        def run():
+            while self.running:
+                time.sleep(interval)
+                self.check()
+        threading.Thread(target=run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
+
+def apply_spotify_credentials(spotify, credentials):
+    """Rotate the client credentials of a running Spotify client.
+
+    The client keeps its session and current access token; the new secret is
+    used from the next token refresh on.
+    """
+    auth_manager = getattr(spotify, 'auth_manager', None)
+    if auth_manager is None or not hasattr(auth_manager, 'client_secret'):
+        raise ValueError("Spotify client uses a fixed API token; restart to change credentials")
+    if not credentials.get('client_secret'):
+        raise ValueError("client_secret is missing")
+
+    client_id = credentials.get('client_id', auth_manager.client_id)
+    if client_id != auth_manager.client_id:
+        print("Spotify client id changed; the next token refresh may ask you to log in again.")
+        auth_manager.client_id = client_id
+    auth_manager.client_secret = credentials['client_secret']
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# Profiling - Per-stage timing spans and sampled cProfile dumps for the trackers
+
+import atexit
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_TRACE_FILE = 'profile.jsonl'
+DEFAULT_SAMPLE_EVERY = 600  # Seconds between the starts of two cProfile windows
+DEFAULT_SAMPLE_WINDOW = 30  # Seconds each cProfile window lasts
+
+# Active profiler, if any; span() and event() cost next to nothing without one
+PROFILER = None
+
+
+class _NoSpan:
+    """Shared do-nothing context manager used while profiling is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Span:
+    """Times one pipeline stage and adds it to the current event."""
+
+    def __init__(self, profiler, stage, fields):
+        self.profiler = profiler
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {'stage': self.stage, 'ms': round((time.perf_counter() - self.started) * 1000, 3)}
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.fields)
+        self.profiler.add_span(record)
+        return False
+
+
+class Event:
+    """Groups the spans of one pipeline run (a poll, a transfer) into one trace line."""
+
+    def __init__(self, profiler, name, fields):
+        self.profiler = profiler
+        self.name = name
+        self.fields = fields
+        self.spans = []
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = self.profiler.sampler_profile()
+        self.parent = getattr(self.profiler.local, 'event', None)
+        self.profiler.local.event = self
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        self.profiler.local.event = self.parent
+        self.profiler.finish_sample(self.profile)
+        record = {
+            'ts': round(self.started_at, 3),
+            'event': self.name,
+            'ms': round(elapsed * 1000, 3),
+            'spans': self.spans,
+        }
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.fields)
+        self.profiler.write(record)
+        return False
+
+
+class Profiler:
+    """Writes per-event timing traces and optionally samples cProfile windows.
+
+    Every `sample_every` seconds a cProfile window of `sample_window` seconds
+    opens; events that start inside it are profiled on whichever thread runs
+    them, and the merged stats are dumped to `profile_dir` when it closes.
+    """
+
+    def __init__(self, trace_file=DEFAULT_TRACE_FILE, profile_dir=None,
+                 sample_every=DEFAULT_SAMPLE_EVERY, sample_window=DEFAULT_SAMPLE_WINDOW):
+        self.trace_file = trace_file
+        self.profile_dir = profile_dir
+        self.sample_every = sample_every
+        self.sample_window = sample_window
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.file = open(trace_file, 'a', buffering=1)
+        self.window_start = time.monotonic()
+        self.stats = None
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def add_span(self, record):
+        event = getattr(self.local, 'event', None)
+        if event is not None:
+            event.spans.append(record)
+        else:
+            # Span outside any event: write it on its own
+            record['ts'] = round(time.time(), 3)
+            self.write(record)
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self.lock:
+            if self.file:
+                self.file.write(line + '\n')
+
+    def sampler_profile(self):
+        """Return a started cProfile.Profile if a sampling window is open."""
+        if not self.profile_dir:
+            return None
+        if getattr(self.local, 'profiling', False):
+            # Nested event; the outer one is already being profiled
+            return None
+        elapsed = (time.monotonic() - self.window_start) % self.sample_every
+        if elapsed >= self.sample_window:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler per process, and it
+            # already sees every thread; this event is covered by it
+            return None
+        self.local.profiling = True
+        return profile
+
+    def finish_sample(self, profile):
+        """Stop a profile, merge it and dump the window's stats once it has closed."""
+        if profile is None:
+            return
+        profile.disable()
+        self.local.profiling = False
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            elapsed = (time.monotonic() - self.window_start) % self.sample_every
+            if elapsed >= self.sample_window:
+                self.dump_stats()
+
+    def dump_stats(self):
+        """Write the merged stats of the current window. Caller holds the lock."""
+        if self.stats is None:
+            return
+        name = datetime.now().strftime('profile-%Y%m%d-%H%M%S.prof')
+        path = os.path.join(self.profile_dir, name)
+        self.stats.dump_stats(path)
+        self.stats = None
+        print(f"\nWrote cProfile sample to {path}")
+
+    def close(self):
+        with self.lock:
+            if self.profile_dir:
+                self.dump_stats()
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def span(stage, **fields):
+    """Time a pipeline stage (fetch, decode, parse, search, device_lookup, playback, seek)."""
+    if PROFILER is None:
+        return NO_SPAN
+    return Span(PROFILER, stage, fields)
+
+
+def event(name, **fields):
+    """Group the spans of one pipeline run into a single trace line."""
+    if PROFILER is None:
+        return NO_SPAN
+    return Event(PROFILER, name, fields)
+
+
+def start_profiling(trace_file=DEFAULT_TRACE_FILE, profile_dir=None,
+                    sample_every=DEFAULT_SAMPLE_EVERY, sample_window=DEFAULT_SAMPLE_WINDOW):
+    """Start writing timing traces, and cProfile samples if a directory is given."""
+    global PROFILER
+    stop_profiling()
+    PROFILER = Profiler(trace_file, profile_dir, sample_every, sample_window)
+    atexit.register(stop_profiling)
+    print(f"Profiling to {trace_file}")
+    if profile_dir:
+        print(f"cProfile samples: {sample_window}s every {sample_every}s in {profile_dir}")
+
+
+def stop_profiling():
+    """Stop profiling and flush everything to disk."""
+    global PROFILER
+    if PROFILER:
+        PROFILER.close()
+        PROFILER = None
+
+
+def add_arguments(parser):
+    """Add the --profile options to a tracker's argument parser."""
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_TRACE_FILE, metavar='TRACE',
+                        help=f"Write per-stage timings to a trace file (default {DEFAULT_TRACE_FILE})")
+    parser.add_argument('--profile-dir', metavar='DIR',
+                        help="Also dump sampled cProfile stats to this directory")
+    parser.add_argument('--profile-every', type=float, default=DEFAULT_SAMPLE_EVERY, metavar='SECONDS',
+                        help="Seconds between cProfile samples")
+    parser.add_argument('--profile-window', type=float, default=DEFAULT_SAMPLE_WINDOW, metavar='SECONDS',
+                        help="Length of each cProfile sample in seconds")
+
+
+def start_from_args(args):
+    """Start profiling if --profile or --profile-dir was given."""
+    if args.profile or args.profile_dir:
+        start_profiling(args.profile or DEFAULT_TRACE_FILE, args.profile_dir,
+                        args.profile_every, args.profile_window)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# Trace Replay - Records pipeline inputs and replays them at accelerated speed
+
+import argparse
+import atexit
+import contextlib
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+
+import profiling
+from resolution_store import compact_search_results
+
+# Event kinds stored in a trace
+STATION = 'station'  # Raw station feed response, keyed by station id
+SONOS = 'sonos'  # Sonos track info snapshot, keyed by player name
+SEARCH = 'search'  # Spotify search response, keyed by query
+
+# Active recorder, if any; record() is a no-op without one
+RECORDER = None
+
+
+class TraceRecorder:
+    """Writes timestamped events to a gzip-compressed JSON lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.file = gzip.open(path, 'wt', encoding='utf-8')
+
+    def record(self, kind, key, data):
+        """Append one event."""
+        event = {'t': round(time.time() - self.started, 3), 'kind': kind, 'key': key, 'data': data}
+        line = json.dumps(event, separators=(',', ':'))
+        with self.lock:
+            if self.file:
+                self.file.write(line + '\n')
+
+    def close(self):
+        """Flush and close the trace file."""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+def start_recording(path):
+    """Start recording pipeline inputs to the given trace file."""
+    global RECORDER
+    stop_recording()
+    RECORDER = TraceRecorder(path)
+    atexit.register(stop_recording)
+    print(f"Recording trace to {path}")
+
+
+def stop_recording():
+    """Stop recording and close the trace file."""
+    global RECORDER
+    if RECORDER:
+        RECORDER.close()
+        RECORDER = None
+
+
+def record(kind, key, data):
+    """Record an event if a recording is running."""
+    if RECORDER:
+        RECORDER.record(kind, key, data)
+
+
+def record_response(key, response=None, error=None):
+    """Record a raw station feed response, or the error that prevented one."""
+    if not RECORDER:
+        return
+    if response is None:
+        RECORDER.record(STATION, key, {'error': str(error)})
+    else:
+        RECORDER.record(STATION, key, {'status': response.status_code, 'body': response.text})
+
+
+def record_search(query, results):
+    """Record a Spotify search response, keeping only the fields the trackers use."""
+    if not RECORDER:
+        return
+    RECORDER.record(SEARCH, query, compact_search_results(results))
+
+
+def load_trace(path):
+    """Load a trace file and return its events ordered by time."""
+    events = []
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                events.append(json.loads(line))
+    except (EOFError, json.JSONDecodeError):
+        # The recording was cut off; use what was written
+        print(f"Trace {path} is truncated, replaying {len(events)} events.")
+    events.sort(key=lambda event: event['t'])
+    return events
+
+
+class TraceFinished(Exception):
+    """Raised by the stand-ins when the trace has been fully replayed."""
+
+
+class VirtualClock:
+    """Stand-in for the time module that runs `speed` times faster than real time.
+
+    With speed 0 sleeping returns immediately and only virtual time advances.
+    """
+
+    def __init__(self, speed=1000.0, start=0.0):
+        self.speed = speed
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if self.speed:
+            time.sleep(seconds / self.speed)
+        self.now += seconds
+
+    def advance_to(self, moment):
+        """Sleep until the given virtual time."""
+        if moment > self.now:
+            self.sleep(moment - self.now)
+
+
+@contextlib.contextmanager
+def patched_clock(module, clock):
+    """Make a module use the virtual clock in place of the time module."""
+    original = module.time
+    module.time = clock
+    try:
+        yield clock
+    finally:
+        module.time = original
+
+
+class ReplayResponse:
+    """Stand-in for a requests response built from a recorded station event."""
+
+    def __init__(self, data):
+        self.status_code = data['status']
+        self.text = data['body']
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"HTTP {self.status_code} (replayed)")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplaySession:
+    """Stand-in for the station engine's HTTP session.
+
+    Returns the recorded response of the event currently being replayed.
+    """
+
+    def __init__(self):
+        self.current = None
+        self.requests = 0
+
+    def get(self, url, timeout=None):
+        self.requests += 1
+        data = self.current['data']
+        if 'error' in data:
+            raise IOError(f"{data['error']} (replayed)")
+        return ReplayResponse(data)
+
+
+class ReplaySonosDevice:
+    """Stand-in for a Sonos device that plays back recorded track info snapshots.
+
+    The last snapshot keeps playing for `settle` seconds after the end of the
+    trace, so a track change that is still waiting out the tracker's cooldown
+    gets transferred.
+    """
+
+    def __init__(self, player_name, snapshots, clock, settle=0.0):
+        self.player_name = player_name
+        self.snapshots = snapshots
+        self.clock = clock
+        self.settle = settle
+        self.index = 0
+        self.polls = 0
+
+    def get_current_track_info(self):
+        if self.clock.now > self.snapshots[-1]['t'] + self.settle:
+            raise TraceFinished()
+        while self.index + 1 < len(self.snapshots) and self.snapshots[self.index + 1]['t'] <= self.clock.now:
+            self.index += 1
+        self.polls += 1
+        return dict(self.snapshots[self.index]['data'])
+
+
+class ReplaySpotify:
+    """Stand-in for the Spotify client that answers searches from the trace.
+
+    Playback calls are only counted.
+    """
+
+    def __init__(self, searches):
+        self.searches = searches
+        self.calls = {'search': 0, 'search_misses': 0, 'devices': 0, 'start_playback': 0, 'seek_track': 0}
+        self.lock = threading.Lock()
+
+    def count(self, call):
+        with self.lock:
+            self.calls[call] += 1
+
+    def search(self, q, type='track', limit=1):
+        self.count('search')
+        if q not in self.searches:
+            self.count('search_misses')
+            return {'tracks': {'items': []}}
+        return self.searches[q]
+
+    def devices(self):
+        self.count('devices')
+        return {'devices': [{'id': 'replay', 'name': 'Replay', 'type': 'Computer', 'is_active': True}]}
+
+    def start_playback(self, device_id=None, uris=None):
+        self.count('start_playback')
+
+    def seek_track(self, position_ms, device_id=None):
+        self.count('seek_track')
+
+
+def replay_stations(events, spotify, clock, registry_path=None):
+    """Feed recorded station responses through the station engine and Spotify update."""
+    import circuit_breaker
+    import stations
+    from spotify_client import update_spotify
+
+    registry = stations.load_stations(registry_path or stations.STATIONS_FILE)
+    known = {station['id']: station for station in registry}
+    session = ReplaySession()
+    songs = []
+
+    def on_song(station, song_info):
+        songs.append(song_info)
+        update_spotify(spotify, song_info, device_id='replay')
+
+    engine = stations.StationEngine([], on_song, session=session, max_workers=1)
+    # Breaker backoffs have to expire in virtual time too
+    with patched_clock(circuit_breaker, clock):
+        for event in events:
+            station = known.get(event['key'])
+            if station is None:
+                continue
+            if station['id'] not in engine.stations:
+                engine.add_station(station)
+            clock.advance_to(event['t'])
+            session.current = event
+            engine.poll(station['id'])
+    return {'station_events': session.requests, 'station_songs': len(songs)}
+
+
+def replay_sonos(events, spotify, clock):
+    """Feed recorded Sonos snapshots through run.track_songs, one player after another."""
+    import run
+
+    players = {}
+    for event in events:
+        players.setdefault(event['key'], []).append(event)
+
+    polls = 0
+    for player_name, snapshots in players.items():
+        clock.now = snapshots[0]['t']
+        device = ReplaySonosDevice(player_name, snapshots, clock, run.TRANSFER_COOLDOWN + run.SONOS_POLL_INTERVAL)
+        with patched_clock(run, clock):
+            try:
+                run.track_songs(device, spotify)
+            except TraceFinished:
+                pass
+            # Let the last debounced transfers finish
+            for thread in threading.enumerate():
+                if thread.name == run.TRANSFER_THREAD_NAME:
+                    thread.join()
+        polls += device.polls
+    return {'sonos_polls': polls}
+
+
+def replay(path, speed=1000.0, registry_path=None, quiet=True):
+    """Replay a trace against local stand-ins and return load statistics."""
+    events = load_trace(path)
+    searches = {event['key']: event['data'] for event in events if event['kind'] == SEARCH}
+    spotify = ReplaySpotify(searches)
+    duration = events[-1]['t'] - events[0]['t'] if events else 0.0
+
+    output = open(os.devnull, 'w') if quiet else sys.stdout
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        stats = replay_stations([e for e in events if e['kind'] == STATION], spotify,
+                                VirtualClock(speed, events[0]['t'] if events else 0.0), registry_path)
+        stats.update(replay_sonos([e for e in events if e['kind'] == SONOS], spotify, VirtualClock(speed)))
+    elapsed = time.perf_counter() - started
+    if quiet:
+        output.close()
+
+    stats.update(spotify.calls)
+    stats['events'] = len(events)
+    stats['trace_seconds'] = round(duration, 1)
+    stats['wall_seconds'] = round(elapsed, 3)
+    stats['speedup'] = round(duration / elapsed, 1) if elapsed else None
+    return stats
+
+
+def main():
+    """Main function to replay a recorded trace."""
+    parser = argparse.ArgumentParser(description="Replay a recorded trace through the tracking pipeline.")
+    parser.add_argument('trace', help="Trace file written with --record")
+    parser.add_argument('--speed', type=float, default=1000.0,
+                        help="Times faster than real time (0 = as fast as possible)")
+    parser.add_argument('--stations', help="Station registry file")
+    parser.add_argument('--verbose', action='store_true', help="Show the trackers' output")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    print("=== Trace Replay ===")
+    profiling.start_from_args(args)
+    stats = replay(args.trace, args.speed, args.stations, quiet=not args.verbose)
+    for key, value in stats.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
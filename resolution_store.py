@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# Resolution Store - Track resolutions and Spotify rate budget shared between processes
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+STORE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resolutions.db')
+
+HIT_TTL = 30 * 24 * 3600  # Seconds a found track stays cached
+MISS_TTL = 24 * 3600  # Seconds a search without results stays cached
+CLAIM_TIMEOUT = 15  # Seconds another process may take to finish a search before we do it ourselves
+
+DEFAULT_RATE = 10  # Spotify API calls per second across all processes
+DEFAULT_BURST = 20  # Calls that may be made at once after a quiet period
+
+
+def compact_search_results(results):
+    """Keep only the fields of a Spotify search response the trackers use."""
+    items = [
+        {'uri': item['uri'], 'name': item['name'], 'artists': [{'name': a['name']} for a in item['artists']]}
+        for item in results['tracks']['items']
+    ]
+    return {'tracks': {'items': items}}
+
+
+class ResolutionStore:
+    """SQLite-backed store shared by all worker processes.
+
+    It caches Spotify search results by query, makes sure only one process
+    runs a given search at a time, and holds a token bucket that every
+    process draws from before calling the Spotify API.
+    """
+
+    def __init__(self, path=STORE_FILE, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()  # One connection per process, shared by its threads
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute("""CREATE TABLE IF NOT EXISTS resolutions (
+            query TEXT PRIMARY KEY, results TEXT NOT NULL, found INTEGER NOT NULL, resolved_at REAL NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS claims (
+            query TEXT PRIMARY KEY, claimed_at REAL NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS rate_budget (
+            id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL NOT NULL, updated REAL NOT NULL)""")
+        self.db.execute('INSERT OR IGNORE INTO rate_budget VALUES (1, ?, ?)', (burst, time.time()))
+
+    def lookup(self, query):
+        """Return cached search results for a query, or None."""
+        with self.lock:
+            row = self.db.execute(
+                'SELECT results, found, resolved_at FROM resolutions WHERE query = ?', (query,)
+            ).fetchone()
+        if row is None:
+            return None
+        results, found, resolved_at = row
+        if time.time() - resolved_at > (HIT_TTL if found else MISS_TTL):
+            return None
+        return json.loads(results)
+
+    def save(self, query, results):
+        """Cache search results and release the claim on the query."""
+        compact = compact_search_results(results)
+        with self.lock, self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.db.execute(
+                'INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?)',
+                (query, json.dumps(compact, separators=(',', ':')), int(bool(compact['tracks']['items'])), time.time())
+            )
+            self.db.execute('DELETE FROM claims WHERE query = ?', (query,))
+        return compact
+
+    def claim(self, query):
+        """Claim a query for searching.
+
+        Returns False if another process is on it or has just saved its results.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            row = self.db.execute('SELECT claimed_at FROM claims WHERE query = ?', (query,)).fetchone()
+            if row and now - row[0] < CLAIM_TIMEOUT:
+                return False
+            row = self.db.execute(
+                'SELECT 1 FROM resolutions WHERE query = ? AND resolved_at > ?', (query, now - CLAIM_TIMEOUT)
+            ).fetchone()
+            if row:
+                return False
+            self.db.execute('INSERT OR REPLACE INTO claims VALUES (?, ?)', (query, now))
+        return True
+
+    def release(self, query):
+        """Drop a claim without saving results, e.g. after a failed search."""
+        with self.lock:
+            self.db.execute('DELETE FROM claims WHERE query = ?', (query,))
+
+    def take_token(self):
+        """Take one call from the shared rate budget. Returns seconds to wait if empty."""
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            tokens, updated = self.db.execute('SELECT tokens, updated FROM rate_budget WHERE id = 1').fetchone()
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            if tokens >= 1:
+                self.db.execute('UPDATE rate_budget SET tokens = ?, updated = ? WHERE id = 1', (tokens - 1, now))
+                return 0.0
+            self.db.execute('UPDATE rate_budget SET tokens = ?, updated = ? WHERE id = 1', (tokens, now))
+            return (1 - tokens) / self.rate
+
+    def wait_for_budget(self):
+        """Block until a Spotify call fits into the shared rate budget."""
+        while True:
+            wait = self.take_token()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def resolve(self, query, search):
+        """Return search results for a query, running `search` at most once across all processes.
+
+        If the process holding the claim goes away, the claim expires after
+        CLAIM_TIMEOUT and this process takes it over.
+        """
+        while True:
+            results = self.lookup(query)
+            if results is not None:
+                return results
+            if self.claim(query):
+                try:
+                    self.wait_for_budget()
+                    return self.save(query, search())
+                except Exception:
+                    self.release(query)
+                    raise
+            time.sleep(0.2)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class SharedSpotify:
+    """Wraps a Spotify client so searches go through the resolution store
+    and every API call draws from the shared rate budget.
+    """
+
+    def __init__(self, spotify, store):
+        self.spotify = spotify
+        self.store = store
+
+    def search(self, q, type='track', limit=1, **kwargs):
+        if type != 'track' or limit != 1 or kwargs:
+            self.store.wait_for_budget()
+            return self.spotify.search(q=q, type=type, limit=limit, **kwargs)
+        return self.store.resolve(q, lambda: self.spotify.search(q=q, type=type, limit=limit))
+
+    def __getattr__(self, name):
+        attribute = getattr(self.spotify, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            self.store.wait_for_budget()
+            return attribute(*args, **kwargs)
+        return call
@@ -1,90 +1,34 @@
 #!/usr/bin/env python3
 # Sonos Song Tracker - Tracks songs playing on a selected Sonos device
 
+import argparse
 import soco
 import time
 import os
-import json
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+import re
+import threading
+import urllib.parse
 from datetime import datetime
 from soco.data_structures import DidlMusicTrack, DidlResource  # Updated import
 
-# Spotify API configuration
-SPOTIFY_SCOPE = 'user-read-playback-state user-modify-playback-state app-remote-control streaming'
-SPOTIFY_CLIENT_ID = 'c6574dd525bd4d58a95c2ef7541056bb'
-SPOTIFY_CREDENTIALS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'spotify_credentials.json')
-SPOTIFY_REDIRECT_URIS = [
-    "http://localhost:8888/callback",
-    "http://127.0.0.1:8888/callback",
-]
-
-# Track origin to prevent transfer loops
-LAST_TRANSFERRED_URI = None
-TRANSFER_COOLDOWN = 0  # Cooldown timer to prevent immediate transfers
-
-def load_spotify_credentials():
-    """Load Spotify credentials from a file if it exists."""
-    if os.path.exists(SPOTIFY_CREDENTIALS_FILE):
-        try:
-            with open(SPOTIFY_CREDENTIALS_FILE, 'r') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading Spotify credentials: {e}")
-    return None
+import profiling
+import replay
+import transport
+from hot_reload import ConfigWatcher, apply_spotify_credentials, load_json
+from spotify_client import SPOTIFY_CREDENTIALS_FILE, setup_spotify_client
 
-def save_spotify_credentials(client_id, client_secret):
-    """Save Spotify credentials to a file."""
-    try:
-        credentials = {'client_id': client_id, 'client_secret': client_secret}
-        with open(SPOTIFY_CREDENTIALS_FILE, 'w') as f:
-            json.dump(credentials, f)
-        print("Spotify credentials saved for future use.")
-    except Exception as e:
-        print(f"Error saving Spotify credentials: {e}")
+# Optional tracker settings, e.g. {"sonos_device": "Living Room"}; watched while tracking
+TRACKER_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracker_config.json')
 
-def setup_spotify_client(token=None):
-    """Set up and return a Spotify client."""
-    try:
-        if token:
-            return spotipy.Spotify(auth=token)
-        else:
-            credentials = load_spotify_credentials()
-            client_id = SPOTIFY_CLIENT_ID
-            client_secret = os.environ.get('SPOTIPY_CLIENT_SECRET', '')
-
-            if credentials:
-                client_id = credentials.get('client_id', client_id)
-                client_secret = credentials.get('client_secret')
-                print("Using saved Spotify credentials.")
-            elif not client_secret:
-                client_secret = input("Enter your Spotify Client Secret: ").strip()
-                if not client_secret:
-                    raise ValueError("Client secret is required")
-                if input("Save credentials? (y/n): ").lower() == 'y':
-                    save_spotify_credentials(client_id, client_secret)
-
-            for redirect_uri in SPOTIFY_REDIRECT_URIS:
-                try:
-                    print(f"Attempting authentication with redirect URI: {redirect_uri}")
-                    auth_manager = SpotifyOAuth(
-                        client_id=client_id,
-                        client_secret=client_secret,
-                        scope=SPOTIFY_SCOPE,
-                        redirect_uri=redirect_uri,
-                        open_browser=True
-                    )
-                    return spotipy.Spotify(auth_manager=auth_manager)
-                except Exception as e:
-                    print(f"Authentication failed with this redirect URI: {e}")
-                    continue
-            raise ValueError("Failed to authenticate with any redirect URI")
-    except Exception as e:
-        print(f"Error setting up Spotify client: {e}")
-        print("\nCheck that your Spotify app’s redirect URI matches one of:")
-        for uri in SPOTIFY_REDIRECT_URIS:
-            print(f"- {uri}")
-        return None
+TRANSFER_COOLDOWN = float(os.environ.get('SONOS_TRANSFER_COOLDOWN', 3))  # Seconds a track must be stable before transfer
+SONOS_POLL_INTERVAL = 5  # Seconds between Sonos polls while nothing is pending
+TRANSFER_THREAD_NAME = 'sonos-transfer'  # Lets the replay harness wait for transfers in flight
+
+# Bidirectional sync: Spotify changes are mirrored back to Sonos
+ECHO_TIMEOUT = 60  # Seconds a track we pushed to one side counts as our own echo when it shows up there
+SPOTIFY_POLL_MIN = 2  # Seconds between Spotify polls right after a change
+SPOTIFY_POLL_MAX = 15  # Seconds between Spotify polls while nothing changes or playback is paused
+NATURAL_ADVANCE_MARGIN = 10  # Seconds before a track's end in which a Spotify change counts as autoplay
 
 def wait_for_spotify_device(spotify, device_name):
     """Wait for an active Spotify device."""
@@ -105,32 +49,51 @@ def wait_for_spotify_device(spotify, device_name):
         print("\nDevice connection cancelled.")
         return None
 
-def update_spotify_with_sonos_track(spotify, track_info, device_id=None, device_name=None):
-    """Update Spotify with the current Sonos track."""
-    global LAST_TRANSFERRED_URI
-    
+def update_spotify_with_sonos_track(spotify, track_info, device_id=None, device_name=None, state=None, generation=None):
+    """Update Spotify with the current Sonos track.
+
+    With a watcher's TrackerState, the track is remembered as sent to
+    Spotify, and if a generation is given the update is abandoned between API
+    calls as soon as a newer track has superseded it. Returns True once
+    Spotify plays the track, even if the seek is then abandoned or fails.
+    """
     if not spotify or not track_info.get('title'):
         return False
+
+    def superseded():
+        if state and generation is not None and generation != state.generation:
+            print(f"Skipped superseded update: {track_info['artist']} - {track_info['title']}")
+            return True
+        return False
     
+    playing = False
     try:
         query = f"track:{track_info['title']} artist:{track_info['artist']}"
-        results = spotify.search(q=query, type='track', limit=1)
+        with profiling.span('search'):
+            results = spotify.search(q=query, type='track', limit=1)
+        replay.record_search(query, results)
         
         if not results['tracks']['items']:
             print(f"Could not find: {track_info['artist']} - {track_info['title']}")
             return False
             
         track_uri = results['tracks']['items'][0]['uri']
-        LAST_TRANSFERRED_URI = track_uri
         
         if not device_id:
-            devices = spotify.devices()
+            with profiling.span('device_lookup'):
+                devices = spotify.devices()
             active_devices = [d for d in devices.get('devices', []) if d.get('is_active')]
             device_id = active_devices[0]['id'] if active_devices else wait_for_spotify_device(spotify, device_name)
             if not device_id:
                 return False
         
-        spotify.start_playback(device_id=device_id, uris=[track_uri])
+        if superseded():
+            return False
+        if state:
+            state.transferred.set(track_uri)
+        with profiling.span('playback'):
+            spotify.start_playback(device_id=device_id, uris=[track_uri])
+        playing = True
         current_position = 0
         if 'position' in track_info and track_info['position']:
             time_parts = track_info['position'].split(':')
@@ -140,24 +103,254 @@ def update_spotify_with_sonos_track(spotify, track_info, device_id=None, device_
             elif len(time_parts) == 2:
                 minutes, seconds = map(int, time_parts)
                 current_position = (minutes * 60 + seconds) * 1000
-            spotify.seek_track(current_position, device_id=device_id)
+            if superseded():
+                # Spotify already plays this track; only the seek is skipped
+                return True
+            with profiling.span('seek'):
+                spotify.seek_track(current_position, device_id=device_id)
         print(f"Updated Spotify: {track_info['artist']} - {track_info['title']}")
         return True
     except Exception as e:
         print(f"Spotify playback error: {e}")
+        return playing
+
+def spotify_track_id(uri):
+    """Extract the Spotify track id from a Spotify URI or a Sonos track URI."""
+    if not uri:
+        return None
+    match = re.search(r'spotify:track:([A-Za-z0-9]+)', urllib.parse.unquote(uri))
+    return match.group(1) if match else None
+
+class EchoMarker:
+    """Remembers the track last pushed to one side to recognise it coming back.
+
+    The marker matches once: after the echo has been seen, or after
+    ECHO_TIMEOUT seconds, the same track chosen by a user is a real change.
+    """
+
+    def __init__(self):
+        self.track_id = None
+        self.set_at = 0.0
+
+    def set(self, uri):
+        self.track_id = spotify_track_id(uri)
+        self.set_at = time.monotonic()
+
+    def matches(self, uri):
+        """Return True if uri is the pushed track showing up, and forget it."""
+        track_id = spotify_track_id(uri)
+        if not track_id or track_id != self.track_id:
+            return False
+        self.track_id = None
+        return time.monotonic() - self.set_at <= ECHO_TIMEOUT
+
+class TrackerState:
+    """Transfer state of one Sonos watcher.
+
+    Kept per watcher so several devices can be tracked in one process
+    without cancelling each other's transfers or echoes, and so a restarted
+    watcher knows what it already sent to Spotify.
+    """
+
+    def __init__(self):
+        self.generation = 0  # Bumped on every new track; in-flight updates with an older value are abandoned
+        self.transferred_track = None  # Last track info Spotify was updated with
+        self.transferred = EchoMarker()  # Last track pushed to Spotify
+        self.mirrored = EchoMarker()  # Last Spotify track pushed to Sonos
+
+def update_sonos_with_spotify_track(device, playback, state=None):
+    """Play the current Spotify track on Sonos at the same position."""
+    from soco.plugins.sharelink import ShareLinkPlugin
+    
+    item = playback['item']
+    artist = item['artists'][0]['name'] if item.get('artists') else ''
+    try:
+        if state:
+            state.mirrored.set(item['uri'])
+        with profiling.span('playback', side='sonos'):
+            position = ShareLinkPlugin(device).add_share_link_to_queue(item['uri'])
+            device.play_from_queue(position - 1)
+        if playback.get('progress_ms'):
+            with profiling.span('seek', side='sonos'):
+                device.seek(ms_to_time_string(playback['progress_ms']))
+        print(f"Updated Sonos: {artist} - {item['name']}")
+        return True
+    except Exception as e:
+        print(f"Sonos playback error: {e}")
         return False
 
+class SyncReconciler:
+    """Mirrors user changes between Sonos and Spotify in both directions.
+
+    Every track we push to one side is remembered in the watcher's
+    TrackerState. When that track shows up on the receiving side it is
+    recognised once as our own echo and not sent back, so the two sides never
+    ping-pong. Whatever Spotify plays when syncing starts is taken as the
+    starting state, not as a change. Spotify changes also have to be
+    user-initiated: a change right at the end of a track is Spotify's autoplay
+    and is ignored.
+
+    Spotify has no push events, so its currently-playing state is polled
+    adaptively: every SPOTIFY_POLL_MIN seconds right after a change, slowing
+    down to SPOTIFY_POLL_MAX while nothing happens or playback is paused, but
+    always waking up shortly after the current track is due to end.
+    """
+
+    def __init__(self, device, spotify, state):
+        self.device = device
+        self.spotify = spotify
+        self.state = state
+        self.lock = threading.Lock()
+        self.sonos_track = None  # Latest Sonos track info
+        self.spotify_playback = None  # Latest Spotify playback state
+        self.spotify_polled_at = None
+        self.pending = None  # Spotify change waiting out the cooldown
+        self.pending_since = None
+        self.interval = SPOTIFY_POLL_MIN
+        self.running = False
+
+    def should_mirror_sonos(self, track_info):
+        """Return True if a Sonos track change was made by a user and should go to Spotify."""
+        with self.lock:
+            self.sonos_track = track_info
+            if self.state.mirrored.matches(track_info.get('uri')):
+                print(f"Not sending back to Spotify, came from there: {track_info['artist']} - {track_info['title']}")
+                return False
+            playback = self.spotify_playback
+            if playback and playback.get('item') and self.is_on_sonos(playback['item'], track_info):
+                # Both sides already play the same song
+                return False
+            return True
+
+    def is_on_sonos(self, item, track_info=None):
+        """Return True if the Spotify item is what Sonos is playing."""
+        track_info = track_info or self.sonos_track
+        if not track_info:
+            return False
+        track_id = spotify_track_id(track_info.get('uri'))
+        if track_id:
+            return track_id == spotify_track_id(item['uri'])
+        artists = [a['name'].casefold() for a in item.get('artists', [])]
+        return (item['name'].casefold() == (track_info.get('title') or '').casefold() and
+                (track_info.get('artist') or '').casefold() in artists)
+
+    def is_natural_advance(self, previous):
+        """Return True if the previous Spotify track had run out, i.e. autoplay moved on."""
+        if not previous or not previous.get('item') or not previous.get('is_playing'):
+            return False
+        elapsed_ms = (time.monotonic() - self.spotify_polled_at) * 1000
+        remaining_ms = previous['item']['duration_ms'] - (previous.get('progress_ms') or 0) - elapsed_ms
+        return remaining_ms <= NATURAL_ADVANCE_MARGIN * 1000
+
+    def poll_spotify(self):
+        """Poll Spotify once, mirror a settled user change to Sonos and return the next delay."""
+        with profiling.span('fetch', side='spotify'):
+            playback = self.spotify.current_playback()
+        
+        with self.lock:
+            first_poll = self.spotify_polled_at is None
+            previous = self.spotify_playback
+            previous_uri = previous['item']['uri'] if previous and previous.get('item') else None
+            is_natural_advance = previous_uri and self.is_natural_advance(previous)
+            self.spotify_playback = playback
+            self.spotify_polled_at = time.monotonic()
+            
+            if first_poll:
+                # Nothing to compare with yet; this is where Spotify was when we started
+                return self.interval
+            
+            if not playback or not playback.get('item') or not playback.get('is_playing'):
+                self.pending = None
+                self.interval = SPOTIFY_POLL_MAX
+                return self.interval
+            
+            item = playback['item']
+            if item['uri'] != previous_uri:
+                self.interval = SPOTIFY_POLL_MIN
+                self.pending = None
+                if self.state.transferred.matches(item['uri']) or self.is_on_sonos(item):
+                    pass  # Our own echo, or Sonos is already there
+                elif is_natural_advance:
+                    print(f"Not sending Spotify autoplay to Sonos: {item['name']}")
+                else:
+                    self.pending = playback
+                    self.pending_since = time.monotonic()
+            else:
+                self.interval = min(SPOTIFY_POLL_MAX, self.interval * 1.5)
+                if self.pending:
+                    # Same song as before; keep the newest position for the seek
+                    self.pending = playback
+            
+            push = None
+            if self.pending and time.monotonic() - self.pending_since >= TRANSFER_COOLDOWN:
+                push, self.pending = self.pending, None
+            
+            remaining = (item['duration_ms'] - (playback.get('progress_ms') or 0)) / 1000
+            delay = min(self.interval, max(SPOTIFY_POLL_MIN, remaining + 0.5))
+            if self.pending:
+                delay = min(delay, max(0.5, TRANSFER_COOLDOWN - (time.monotonic() - self.pending_since)))
+        
+        if push:
+            with profiling.event('mirror', player=self.device.player_name, track=push['item']['name']):
+                update_sonos_with_spotify_track(self.device, push, self.state)
+        return delay
+
+    def run(self):
+        """Poll Spotify until stopped."""
+        while self.running:
+            try:
+                delay = self.poll_spotify()
+            except Exception as e:
+                print(f"Spotify sync error: {e}")
+                delay = SPOTIFY_POLL_MAX
+            time.sleep(delay)
+
+    def start(self):
+        """Start polling Spotify in the background."""
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.running = False
+
 def discover_sonos_devices():
     """Discover Sonos devices on the network."""
     print("Discovering Sonos devices...")
     return list(soco.discover())
 
+def load_tracker_config():
+    """Load the tracker settings if the file exists."""
+    if os.path.exists(TRACKER_CONFIG_FILE):
+        try:
+            return load_json(TRACKER_CONFIG_FILE)
+        except Exception as e:
+            print(f"Error loading tracker config: {e}")
+    return {}
+
+def find_device(target, devices=None):
+    """Find a Sonos device by player name or IP address."""
+    for device in devices or []:
+        if target in (device.player_name, device.ip_address):
+            return device
+    if re.match(r'^\d+\.\d+\.\d+\.\d+$', target):
+        return soco.SoCo(target)
+    from soco.discovery import by_name
+    return by_name(target)
+
 def select_device(devices):
     """Allow user to select a Sonos device."""
     if not devices:
         print("No Sonos devices found.")
         exit(1)
     
+    configured = load_tracker_config().get('sonos_device')
+    if configured:
+        device = find_device(configured, devices)
+        if device:
+            print(f"\nUsing configured device: {device.player_name} ({device.ip_address})")
+            return device
+        print(f"Configured device not found: {configured}")
+    
     print("\nFound Sonos devices:")
     for i, device in enumerate(devices, 1):
         print(f"{i}. {device.player_name} ({device.ip_address})")
@@ -178,9 +371,28 @@ def ms_to_time_string(ms):
     hours, minutes = divmod(minutes, 60)
     return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
-def track_songs(device, spotify=None):
-    """Track songs on the selected Sonos device."""
+def same_track(a, b):
+    """Return True if two track info dicts describe the same song."""
+    return bool(a and b and a['title'] == b['title'] and a['artist'] == b['artist'])
+
+def track_songs(device, spotify=None, sync=False, watcher=None, state=None):
+    """Track songs on the selected Sonos device.
+
+    Track changes are debounced: a title has to stay put for TRANSFER_COOLDOWN
+    seconds before Spotify is updated, so skipping through several songs only
+    sends the one that sticks. With sync, changes made in Spotify are mirrored
+    back to Sonos as well.
+
+    With a ConfigWatcher, as run.py's main passes, the watcher is checked on
+    every poll and changes to TRACKER_CONFIG_FILE switch the Sonos device,
+    keeping the Spotify connection and what has already been transferred.
+    Trackers that watch several devices in one process pass none.
+
+    Passing the TrackerState of an earlier run resumes it: the song that was
+    already transferred is not sent to Spotify again.
+    """
     print(f"\nTracking {device.player_name}...")
+    state = state or TrackerState()
     spotify_device_id = None
     
     if spotify:
@@ -189,18 +401,59 @@ def track_songs(device, spotify=None):
         active_devices = [d for d in devices.get('devices', []) if d.get('is_active')]
         spotify_device_id = active_devices[0]['id'] if active_devices else None
     
+    reconciler = None
+    if spotify and sync:
+        print("Sync enabled - Spotify changes will update Sonos.")
+        reconciler = SyncReconciler(device, spotify, state)
+        reconciler.start()
+    
+    def switch_device(config):
+        nonlocal device
+        target = config.get('sonos_device')
+        if not target or target in (device.player_name, device.ip_address):
+            return
+        new_device = find_device(target)
+        if not new_device:
+            raise ValueError(f"Sonos device not found: {target}")
+        print(f"\nSwitching from {device.player_name} to {new_device.player_name}")
+        device = new_device
+        if reconciler:
+            reconciler.device = new_device
+
+    if watcher:
+        watcher.watch(TRACKER_CONFIG_FILE, switch_device)
+    
     print("Press Ctrl+C to stop.\n")
     
     current_track_info = None
+    pending_since = None  # Set while current_track_info waits out the cooldown
+    transfer_lock = threading.Lock()
+
+    def transfer(track_info, generation):
+        nonlocal spotify_device_id
+        with transfer_lock:
+            if generation != state.generation:
+                return
+            with profiling.event('transfer', player=device.player_name, track=track_info['title']):
+                success = update_spotify_with_sonos_track(
+                    spotify, track_info, spotify_device_id, f"EMU: {device.player_name}", state, generation
+                )
+                if success:
+                    state.transferred_track = track_info
+                if success and not spotify_device_id:
+                    with profiling.span('device_lookup'):
+                        devices = spotify.devices()
+                    active_devices = [d for d in devices.get('devices', []) if d.get('is_active')]
+                    spotify_device_id = active_devices[0]['id'] if active_devices else None
     
     try:
         while True:
-            track_info = device.get_current_track_info()
+            with profiling.span('fetch', player=device.player_name):
+                track_info = device.get_current_track_info()
             track_info['player_name'] = device.player_name
+            replay.record(replay.SONOS, device.player_name, track_info)
             
-            if (not current_track_info or 
-                track_info['title'] != current_track_info['title'] or
-                track_info['artist'] != current_track_info['artist']):
+            if not same_track(track_info, current_track_info):
                 if track_info['title']:
                     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                     print(f"[{timestamp}] Now playing:")
@@ -211,20 +464,55 @@ def track_songs(device, spotify=None):
                     current_track_info = track_info
                     
                     if spotify:
-                        success = update_spotify_with_sonos_track(
-                            spotify, track_info, spotify_device_id, f"EMU: {device.player_name}"
-                        )
-                        if success and not spotify_device_id:
-                            active_devices = [d for d in spotify.devices().get('devices', []) if d.get('is_active')]
-                            spotify_device_id = active_devices[0]['id'] if active_devices else None
-            time.sleep(5)
+                        # Cancel whatever is still in flight and restart the cooldown
+                        state.generation += 1
+                        pending_since = time.monotonic()
+            elif pending_since is not None:
+                # Same song as before; keep the newest position for the seek
+                current_track_info = track_info
+
+            if pending_since is not None and time.monotonic() - pending_since >= TRANSFER_COOLDOWN:
+                pending_since = None
+                if same_track(current_track_info, state.transferred_track):
+                    print(f"Skipped transfer, already on Spotify: {current_track_info['artist']} - {current_track_info['title']}")
+                elif reconciler and not reconciler.should_mirror_sonos(current_track_info):
+                    state.transferred_track = current_track_info
+                else:
+                    threading.Thread(
+                        target=transfer, args=(current_track_info, state.generation),
+                        name=TRANSFER_THREAD_NAME, daemon=True
+                    ).start()
+
+            if watcher:
+                watcher.check()
+            if pending_since is not None:
+                remaining = TRANSFER_COOLDOWN - (time.monotonic() - pending_since)
+                time.sleep(max(0.5, min(SONOS_POLL_INTERVAL, remaining)))
+            else:
+                time.sleep(SONOS_POLL_INTERVAL)
     except KeyboardInterrupt:
         print("\nStopped tracking.")
+        transport.print_transport_stats()
+    finally:
+        if reconciler:
+            reconciler.stop()
 
 def main():
     """Main function with Spotify integration."""
+    parser = argparse.ArgumentParser(description="Track songs on a Sonos device and optionally mirror them to Spotify.")
+    parser.add_argument('--record', metavar='TRACE', help="Record Sonos track info and Spotify searches to a trace file")
+    parser.add_argument('--sync', action='store_true', help="Also mirror Spotify changes back to Sonos")
+    profiling.add_arguments(parser)
+    transport.add_arguments(parser)
+    args = parser.parse_args()
+    
     print("=== Sonos Song Tracker ===")
     
+    if args.record:
+        replay.start_recording(args.record)
+    profiling.start_from_args(args)
+    transport.start_from_args(args)
+    
     use_spotify = input("Enable Spotify integration? (y/n): ").lower() == 'y'
     spotify = None
     
@@ -237,8 +525,13 @@ def main():
     devices = discover_sonos_devices()
     selected_device = select_device(devices)
     
+    # Pick up device and credential changes without restarting
+    watcher = ConfigWatcher()
+    if spotify:
+        watcher.watch(SPOTIFY_CREDENTIALS_FILE, lambda credentials: apply_spotify_credentials(spotify, credentials))
+    
     # Track Sonos songs and optionally update Spotify
-    track_songs(selected_device, spotify)
+    track_songs(selected_device, spotify, args.sync, watcher)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
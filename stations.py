@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+# Station Tracker - Polls every radio station in the station registry from one process
+
+import argparse
+import heapq
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import circuit_breaker
+import profiling
+import replay
+import transport
+from circuit_breaker import BREAKERS, CircuitBreaker
+from hot_reload import ConfigWatcher, apply_spotify_credentials
+from spotify_client import SPOTIFY_CREDENTIALS_FILE, setup_spotify_client, update_spotify
+
+STATIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stations.json')
+
+# Defaults for the "poll" section of a station entry
+DEFAULT_POLL_POLICY = {
+    'interval': 30,  # Seconds between polls
+    'timeout': 10,  # Request timeout in seconds
+    'failure_threshold': 3,  # Failures before the station's circuit breaker opens
+    'max_backoff': 600,  # Longest wait in seconds while the breaker is open
+}
+
+DEFAULT_MAX_WORKERS = 16  # Threads shared by all stations
+DEFAULT_PER_HOST_LIMIT = 4  # Concurrent connections per host
+
+
+def load_stations(path=STATIONS_FILE):
+    """Load the station registry and fill in default poll policies."""
+    with open(path, 'r') as f:
+        config = json.load(f)
+
+    stations = []
+    seen = set()
+    for entry in config.get('stations', []):
+        if not entry.get('id') or not entry.get('url'):
+            raise ValueError(f"Station entry needs an id and a url: {entry}")
+        if entry['id'] in seen:
+            raise ValueError(f"Duplicate station id: {entry['id']}")
+        parser = entry.get('parser', {}).get('type', 'text')
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser '{parser}' for station {entry['id']}")
+        seen.add(entry['id'])
+
+        station = dict(entry)
+        station.setdefault('name', entry['id'])
+        station.setdefault('parser', {'type': 'text'})
+        station['poll'] = dict(DEFAULT_POLL_POLICY, **entry.get('poll', {}))
+        stations.append(station)
+    return stations
+
+
+def parse_utc_offset(offset):
+    """Turn an offset like '+01:00' into a timezone."""
+    sign = -1 if offset.startswith('-') else 1
+    hours, minutes = offset.lstrip('+-').split(':')
+    return timezone(sign * timedelta(hours=int(hours), minutes=int(minutes)))
+
+
+def format_window_time(moment, offset):
+    """Format a time as ISO 8601 with milliseconds, URL encoded."""
+    return urllib.parse.quote_plus(moment.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + offset)
+
+
+def build_station_url(station, now=None):
+    """Fill the station's URL template.
+
+    Stations with a "window" section get {start} and {end} filled with a time
+    range ending now, e.g. the last five minutes of BigFM's playlist.
+    """
+    window = station.get('window')
+    if not window:
+        return station['url']
+
+    offset = window.get('utc_offset', '+00:00')
+    now = now or datetime.now(parse_utc_offset(offset))
+    past = now - timedelta(minutes=window.get('minutes', 5))
+    return station['url'].format(
+        start=format_window_time(past, offset),
+        end=format_window_time(now, offset),
+    )
+
+
+def json_path(data, path):
+    """Walk a dotted path like 'result.entry.0.title' through dicts and lists."""
+    for key in path.split('.'):
+        if isinstance(data, list):
+            try:
+                data = data[int(key)]
+            except (ValueError, IndexError):
+                return None
+        elif isinstance(data, dict):
+            data = data.get(key)
+        else:
+            return None
+        if data is None:
+            return None
+    return data
+
+
+def parse_text_response(body, options):
+    """Parse an 'Artist - Title' plain text response."""
+    song_text = body.strip()
+    if not song_text:
+        return None
+
+    # Skip station announcements
+    for marker in options.get('ignore', []):
+        if marker in song_text:
+            return None
+
+    separator = options.get('separator', ' - ')
+    if separator in song_text:
+        artist, title = song_text.split(separator, 1)
+        artist, title = artist.strip(), title.strip()
+    else:
+        # If no separator, treat whole string as title
+        artist, title = options.get('default_artist', 'Unknown Artist'), song_text
+
+    return {
+        'artist': artist,
+        'title': title,
+        'full_text': song_text
+    }
+
+
+def parse_json_response(body, options):
+    """Parse a JSON response using the 'title' and 'artist' paths."""
+    data = json.loads(body)
+    title = json_path(data, options['title'])
+    artist = json_path(data, options['artist'])
+
+    if not title or not artist:
+        return None
+
+    return {
+        'artist': str(artist),
+        'title': str(title),
+        'full_text': f"{artist} - {title}"
+    }
+
+
+# Response parsers by the "type" of a station's parser entry
+PARSERS = {
+    'text': parse_text_response,
+    'json': parse_json_response,
+}
+
+
+def parse_station_response(station, body):
+    """Parse a raw response body with the station's configured parser."""
+    options = station['parser']
+    return PARSERS[options.get('type', 'text')](body, options)
+
+
+def print_song(station, song_info):
+    """Default song handler: print the new song."""
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    print(f"[{timestamp}] {station['name']}: {song_info['full_text']}")
+
+
+class StationEngine:
+    """Polls many stations concurrently from one process.
+
+    Stations are kept in a heap ordered by their next poll time; due stations
+    are handed to a fixed thread pool, and each host gets at most
+    `per_host_limit` requests in flight. A station is never polled again while
+    its previous request is still running, so memory stays bounded by the
+    number of stations regardless of how slow the feeds are.
+
+    Stations can be added, changed and removed while the engine runs; the
+    others keep their last song, circuit breaker and connections.
+    """
+
+    def __init__(self, stations, on_song=print_song, session=None,
+                 max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT):
+        self.on_song = on_song
+        self.session = session or transport.get_session()
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.stations = {}
+        self.last_songs = {}  # Station id -> last song text, to report changes only
+        self.breakers = {}
+        self.host_limits = {}
+        self.schedule = []  # Heap of (next poll time, station id)
+        self.scheduled = set()  # Station ids with a heap entry or a poll in flight
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        for station in stations:
+            self.add_station(station)
+
+    def add_station(self, station):
+        """Register a station and schedule its first poll within the next few seconds.
+
+        A station that is already registered is updated in place.
+        """
+        poll = station['poll']
+        with self.lock:
+            self.stations[station['id']] = station
+            breaker = self.breakers.get(station['id'])
+            if breaker is None:
+                self.breakers[station['id']] = CircuitBreaker(
+                    station['id'],
+                    failure_threshold=poll['failure_threshold'],
+                    base_delay=poll['interval'],
+                    max_delay=poll['max_backoff'],
+                )
+            else:
+                breaker.failure_threshold = poll['failure_threshold']
+                breaker.base_delay = poll['interval']
+                breaker.max_delay = poll['max_backoff']
+            if station['id'] not in self.scheduled:
+                # Spread the first polls so hundreds of stations don't fire at once
+                first_poll = time.monotonic() + random.uniform(0, min(poll['interval'], 5))
+                heapq.heappush(self.schedule, (first_poll, station['id']))
+                self.scheduled.add(station['id'])
+        self.wakeup.set()
+
+    def remove_station(self, station_id):
+        """Stop polling a station. A poll in flight finishes but is not rescheduled."""
+        with self.lock:
+            self.stations.pop(station_id, None)
+            self.last_songs.pop(station_id, None)
+            if self.breakers.pop(station_id, None) is not None:
+                BREAKERS.pop(station_id, None)
+
+    def update_stations(self, stations):
+        """Bring the engine in line with a freshly loaded station registry."""
+        new_ids = {station['id'] for station in stations}
+        removed = [station_id for station_id in self.stations if station_id not in new_ids]
+        added = [station['id'] for station in stations if station['id'] not in self.stations]
+        for station_id in removed:
+            self.remove_station(station_id)
+        for station in stations:
+            if self.stations.get(station['id']) != station:
+                self.add_station(station)
+        print(f"Stations: {len(self.stations)} ({len(added)} added, {len(removed)} removed)")
+
+    def host_limit(self, url):
+        """Return the semaphore limiting concurrent requests to the URL's host.
+
+        The first request to a host also gives it a connection pool of the same
+        size in the shared session, so every request can reuse a connection.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host_limit)
+                if hasattr(self.session, 'adapters'):
+                    transport.ensure_host_pool(self.session, url, self.per_host_limit)
+            return self.host_limits[host]
+
+    def fetch(self, station):
+        """Fetch and parse a station's current song. Returns None if unavailable."""
+        breaker = self.breakers[station['id']]
+        if not breaker.allow_request():
+            return None
+
+        url = build_station_url(station)
+        response = None
+        try:
+            with self.host_limit(url), profiling.span('fetch'):
+                response = self.session.get(url, timeout=(transport.CONNECT_TIMEOUT, station['poll']['timeout']))
+            replay.record_response(station['id'], response)
+            response.raise_for_status()
+        except Exception as e:
+            if response is None:
+                replay.record_response(station['id'], error=e)
+            print(f"Error fetching {station['name']}: {e}")
+            breaker.record_failure()
+            return None
+        breaker.record_success()
+
+        try:
+            with profiling.span('parse'):
+                return parse_station_response(station, response.text)
+        except Exception as e:
+            print(f"Error parsing {station['name']}: {e}")
+            return None
+
+    def poll(self, station_id):
+        """Poll one station, report a new song and schedule the next poll."""
+        station = self.stations.get(station_id)
+        if station is None:
+            return
+        try:
+            with profiling.event('poll', station=station_id):
+                song_info = self.fetch(station)
+                if song_info and song_info['full_text'] != self.last_songs.get(station_id):
+                    self.last_songs[station_id] = song_info['full_text']
+                    self.on_song(station, song_info)
+        except Exception as e:
+            print(f"Error handling {station['name']}: {e}")
+        finally:
+            with self.lock:
+                station = self.stations.get(station_id)
+                if station is not None:
+                    delay = max(station['poll']['interval'], self.breakers[station_id].time_until_retry())
+                    heapq.heappush(self.schedule, (time.monotonic() + delay, station_id))
+                else:
+                    self.scheduled.discard(station_id)
+            self.wakeup.set()
+
+    def run(self):
+        """Poll all stations until stop() is called or Ctrl+C is pressed."""
+        self.running = True
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self.running:
+                now = time.monotonic()
+                due = []
+                with self.lock:
+                    while self.schedule and self.schedule[0][0] <= now:
+                        station_id = heapq.heappop(self.schedule)[1]
+                        if station_id in self.stations:
+                            due.append(station_id)
+                        else:
+                            # Removed since it was scheduled
+                            self.scheduled.discard(station_id)
+                    next_poll = self.schedule[0][0] if self.schedule else now + 1
+                for station_id in due:
+                    executor.submit(self.poll, station_id)
+
+                self.wakeup.wait(max(0.05, next_poll - time.monotonic()))
+                self.wakeup.clear()
+
+    def stop(self):
+        """Stop the polling loop."""
+        self.running = False
+        self.wakeup.set()
+
+
+def make_spotify_follower(spotify, station_id):
+    """Return a song handler that plays one station's songs on Spotify."""
+    spotify_lock = threading.Lock()
+
+    def on_song(station, song_info):
+        print_song(station, song_info)
+        if station['id'] == station_id:
+            with spotify_lock:
+                update_spotify(spotify, song_info)
+    return on_song
+
+
+def main():
+    """Main function to track all registered stations."""
+    parser = argparse.ArgumentParser(description="Track songs on all stations in the station registry.")
+    parser.add_argument('--stations', default=STATIONS_FILE, help="Station registry file")
+    parser.add_argument('--follow', metavar='STATION_ID', help="Play this station's songs on Spotify")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help="Polling threads")
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST_LIMIT,
+                        help="Concurrent connections per host")
+    parser.add_argument('--record', metavar='TRACE', help="Record feed responses to a trace file")
+    profiling.add_arguments(parser)
+    transport.add_arguments(parser)
+    circuit_breaker.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.record:
+        replay.start_recording(args.record)
+    profiling.start_from_args(args)
+    transport.start_from_args(args)
+    circuit_breaker.start_from_args(args)
+
+    print("=== Station Tracker ===")
+    stations = load_stations(args.stations)
+
+    on_song = print_song
+    spotify = None
+    if args.follow:
+        if args.follow not in {station['id'] for station in stations}:
+            print(f"Unknown station: {args.follow}")
+            return
+        token = input("Enter your Spotify API token (leave blank for interactive authentication): ").strip()
+        spotify = setup_spotify_client(token if token else None)
+        if not spotify:
+            print("Spotify integration could not be enabled. Exiting.")
+            return
+        on_song = make_spotify_follower(spotify, args.follow)
+
+    engine = StationEngine(stations, on_song, max_workers=args.workers, per_host_limit=args.per_host)
+
+    # Pick up registry and credential changes without restarting
+    watcher = ConfigWatcher()
+    watcher.watch(args.stations, engine.update_stations, loader=load_stations)
+    if spotify:
+        watcher.watch(SPOTIFY_CREDENTIALS_FILE, lambda credentials: apply_spotify_credentials(spotify, credentials))
+    watcher.start()
+
+    print(f"Monitoring {len(stations)} stations...")
+    print("Press Ctrl+C to stop tracking.")
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        engine.stop()
+        watcher.stop()
+        print("\n\nStopped tracking.")
+        transport.print_transport_stats()
+        circuit_breaker.print_breaker_states()
+
+
+if __name__ == "__main__":
+    main()
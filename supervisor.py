@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# Supervisor - Shards stations and Sonos watchers across worker processes
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+import spotipy
+from spotipy.oauth2 import SpotifyOAuth
+
+import profiling
+import replay
+import stations
+import transport
+from circuit_breaker import backoff_delay
+from hot_reload import ConfigWatcher, apply_spotify_credentials
+import spotify_client
+from resolution_store import DEFAULT_BURST, DEFAULT_RATE, STORE_FILE, ResolutionStore, SharedSpotify
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+RESTART_MAX_DELAY = 60  # Longest wait in seconds before restarting a crashing worker
+STABLE_AFTER = 60  # Seconds a worker has to stay up before its crash count is reset
+
+
+def assign_sources(sources, workers):
+    """Split sources into one shard per worker using rendezvous hashing.
+
+    Every source goes to the worker with the highest hash of (worker, source
+    id), so assignments are stable across restarts and changing the number of
+    workers only moves the sources of the workers that were added or removed.
+    """
+    shards = [[] for _ in range(workers)]
+    for source in sources:
+        scores = [hashlib.sha1(f"{worker}:{source['id']}".encode()).digest() for worker in range(workers)]
+        shards[scores.index(max(scores))].append(source)
+    return shards
+
+
+def station_sources(path):
+    """Return a source for every station in the registry."""
+    return [{'id': f"station:{station['id']}", 'kind': 'station', 'station': station}
+            for station in stations.load_stations(path)]
+
+
+def sonos_sources(ip_addresses):
+    """Return a source for every Sonos device address."""
+    return [{'id': f"sonos:{ip}", 'kind': 'sonos', 'ip': ip} for ip in ip_addresses]
+
+
+def worker_file(path, index):
+    """Return a worker's own variant of a file name, e.g. day.jsonl.gz -> day-worker0.jsonl.gz."""
+    directory, name = os.path.split(path)
+    stem, dot, suffix = name.partition('.')
+    return os.path.join(directory, f"{stem}-worker{index}{dot}{suffix}")
+
+
+def create_spotify_client(options):
+    """Create a Spotify client in a worker from the credentials the supervisor collected."""
+    session = transport.get_session()
+    if options.get('token'):
+        return spotipy.Spotify(auth=options['token'], requests_session=session,
+                               requests_timeout=transport.SPOTIFY_TIMEOUT)
+
+    auth_manager = SpotifyOAuth(
+        client_id=options['client_id'],
+        client_secret=options['client_secret'],
+        scope=spotify_client.SPOTIFY_SCOPE,
+        redirect_uri=spotify_client.SPOTIFY_REDIRECT_URIS[0],
+        open_browser=False,  # The supervisor already logged in; the token comes from the cache
+        requests_session=session,
+        requests_timeout=transport.SPOTIFY_TIMEOUT
+    )
+    return spotipy.Spotify(auth_manager=auth_manager, requests_session=session,
+                           requests_timeout=transport.SPOTIFY_TIMEOUT)
+
+
+def make_station_handler(spotify, follow, prefetch=False):
+    """Return a song handler that plays the followed station's songs.
+
+    With prefetch, the songs of the other stations are resolved too, so
+    switching stations finds them in the store. That spends the shared rate
+    budget on searches nobody may need, so it is off by default.
+    """
+    def on_song(station, song_info):
+        stations.print_song(station, song_info)
+        if not spotify:
+            return
+        if station['id'] == follow:
+            spotify_client.update_spotify(spotify, song_info)
+        elif prefetch:
+            spotify.search(q=f"track:{song_info['title']} artist:{song_info['artist']}", type='track', limit=1)
+    return on_song
+
+
+def watch_sonos(ip, spotify):
+    """Track one Sonos device, restarting the watcher with backoff when it fails.
+
+    The watcher's state survives restarts, so the song that is already on
+    Spotify is not sent again after a crash.
+    """
+    import soco
+    import run
+
+    state = run.TrackerState()
+    failures = 0
+    while True:
+        started = time.monotonic()
+        try:
+            run.track_songs(soco.SoCo(ip), spotify, state=state)
+        except Exception as e:
+            print(f"\nSonos watcher for {ip} failed: {e}")
+        if time.monotonic() - started > STABLE_AFTER:
+            failures = 0
+        failures += 1
+        delay = backoff_delay(failures, 1, RESTART_MAX_DELAY)
+        print(f"Restarting Sonos watcher for {ip} in {delay:.0f}s")
+        time.sleep(delay)
+
+
+def worker_main(index, sources, options):
+    """Run one worker's share of the sources until it is stopped."""
+    # Don't share the supervisor's pooled connections with it
+    transport.reset_session()
+    # Forked workers skip atexit handlers, so turn terminate() into an exit that runs the cleanup below
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if options.get('record'):
+        replay.start_recording(worker_file(options['record'], index))
+    if options.get('profile'):
+        profile_dir = worker_file(options['profile_dir'], index) if options.get('profile_dir') else None
+        profiling.start_profiling(worker_file(options['profile'], index), profile_dir,
+                                  options['profile_every'], options['profile_window'])
+    store = ResolutionStore(options['store'], options['rate'], options['burst'])
+    spotify = None
+    if options.get('spotify'):
+        spotify = SharedSpotify(create_spotify_client(options), store)
+
+    print(f"[worker {index}] {len(sources)} sources: {', '.join(source['id'] for source in sources)}")
+    # Only --spotify mirrors Sonos; --follow and --prefetch use Spotify for the stations alone
+    sonos_spotify = spotify if options.get('mirror_sonos') else None
+    for source in sources:
+        if source['kind'] == 'sonos':
+            threading.Thread(target=watch_sonos, args=(source['ip'], sonos_spotify), daemon=True).start()
+
+    def reload_stations(path):
+        # Every worker shards the registry the same way and keeps only its own share
+        shard = assign_sources(station_sources(path), options['workers'])[index]
+        return [source['station'] for source in shard]
+
+    # Read the registry afresh so a restarted worker sees stations added since startup
+    engine = stations.StationEngine(reload_stations(options['stations']),
+                                    make_station_handler(spotify, options.get('follow'), options.get('prefetch')))
+
+    watcher = ConfigWatcher()
+    watcher.watch(options['stations'], engine.update_stations, loader=reload_stations)
+    if spotify and not options.get('token'):
+        watcher.watch(spotify_client.SPOTIFY_CREDENTIALS_FILE, lambda credentials: apply_spotify_credentials(spotify, credentials))
+    watcher.start()
+
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        store.close()
+        replay.stop_recording()
+        profiling.stop_profiling()
+
+
+class Supervisor:
+    """Starts one process per shard and restarts workers that crash.
+
+    Crashing workers are restarted after a jittered exponential backoff so a
+    worker that dies on startup does not spin.
+    """
+
+    def __init__(self, shards, options):
+        self.shards = shards
+        self.options = options
+        self.processes = {}
+        self.started_at = {}
+        self.crashes = {}
+        self.restart_at = {}
+        self.running = False
+
+    def start_worker(self, index):
+        process = multiprocessing.Process(
+            target=worker_main, args=(index, self.shards[index], self.options), name=f"worker-{index}", daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.monotonic()
+
+    def check_workers(self):
+        """Schedule restarts for dead workers and start those that are due."""
+        now = time.monotonic()
+        for index, process in list(self.processes.items()):
+            if process is None or process.is_alive():
+                if process is not None and now - self.started_at[index] > STABLE_AFTER:
+                    self.crashes[index] = 0
+                continue
+            self.crashes[index] = self.crashes.get(index, 0) + 1
+            delay = backoff_delay(self.crashes[index], 1, RESTART_MAX_DELAY)
+            print(f"\nWorker {index} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+            self.processes[index] = None
+            self.restart_at[index] = now + delay
+
+        for index, due in list(self.restart_at.items()):
+            if now >= due:
+                del self.restart_at[index]
+                self.start_worker(index)
+
+    def run(self):
+        """Start all workers and keep them running until Ctrl+C."""
+        self.running = True
+        # Workers with no sources yet still run, to pick up stations added later
+        for index in range(len(self.shards)):
+            self.start_worker(index)
+        while self.running:
+            self.check_workers()
+            time.sleep(1)
+
+    def stop(self):
+        """Stop all workers."""
+        self.running = False
+        for process in self.processes.values():
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            if process is not None:
+                process.join(5)
+
+
+def collect_spotify_options(token):
+    """Log in once in the supervisor and return what the workers need to do the same."""
+    if token:
+        return {'token': token}
+    credentials = spotify_client.load_spotify_credentials() or {}
+    client_id = credentials.get('client_id', spotify_client.SPOTIFY_CLIENT_ID)
+    client_secret = credentials.get('client_secret') or os.environ.get('SPOTIPY_CLIENT_SECRET', '')
+    if not client_secret:
+        client_secret = input("Enter your Spotify Client Secret: ").strip()
+    options = {'client_id': client_id, 'client_secret': client_secret}
+
+    # Log in interactively here so the workers find a cached token
+    spotify = create_spotify_client(options)
+    spotify.auth_manager.get_access_token(as_dict=False)
+    return options
+
+
+def main():
+    """Main function to shard all sources across worker processes."""
+    parser = argparse.ArgumentParser(description="Track many stations and Sonos devices with several worker processes.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Worker processes")
+    parser.add_argument('--stations', default=stations.STATIONS_FILE, help="Station registry file")
+    parser.add_argument('--sonos', action='append', default=[], metavar='IP', help="Sonos device to watch")
+    parser.add_argument('--discover', action='store_true', help="Watch every Sonos device on the network")
+    parser.add_argument('--spotify', action='store_true', help="Mirror the Sonos devices to Spotify")
+    parser.add_argument('--token', help="Spotify API token (default: interactive authentication)")
+    parser.add_argument('--follow', metavar='STATION_ID', help="Play this station's songs on Spotify")
+    parser.add_argument('--prefetch', action='store_true',
+                        help="Also resolve the songs of stations that are not followed")
+    parser.add_argument('--store', default=STORE_FILE, help="Shared track resolution store")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Spotify calls per second, all workers together")
+    parser.add_argument('--burst', type=float, default=DEFAULT_BURST, help="Spotify calls allowed at once")
+    parser.add_argument('--record', metavar='TRACE',
+                        help="Record feed responses, Sonos track info and searches to one trace file per worker")
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+
+    print("=== Tracker Supervisor ===")
+    sources = station_sources(args.stations)
+    ip_addresses = list(args.sonos)
+    if args.discover:
+        import soco
+        ip_addresses += [device.ip_address for device in soco.discover() or []]
+    sources += sonos_sources(sorted(set(ip_addresses)))
+
+    workers = max(1, args.workers)
+    options = {'store': args.store, 'rate': args.rate, 'burst': args.burst, 'stations': args.stations,
+               'workers': workers, 'spotify': args.spotify or bool(args.follow) or args.prefetch,
+               'mirror_sonos': args.spotify, 'follow': args.follow, 'prefetch': args.prefetch,
+               'record': args.record, 'profile_dir': args.profile_dir,
+               'profile': args.profile or (profiling.DEFAULT_TRACE_FILE if args.profile_dir else None),
+               'profile_every': args.profile_every, 'profile_window': args.profile_window}
+    if options['spotify']:
+        options.update(collect_spotify_options(args.token))
+
+    # Create the store once up front so workers don't race to set it up
+    ResolutionStore(args.store, args.rate, args.burst).close()
+
+    shards = assign_sources(sources, workers)
+    print(f"Sharding {len(sources)} sources across {len(shards)} workers.")
+    print("Press Ctrl+C to stop tracking.")
+    supervisor = Supervisor(shards, options)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
+        print("\n\nStopped tracking.")
+
+
+if __name__ == "__main__":
+    main()
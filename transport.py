@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# Transport - One tuned HTTP session shared by Spotify and the station feeds
+
+import socket
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CONNECT_TIMEOUT = 3.05  # Seconds to establish a connection
+READ_TIMEOUT = 10  # Seconds to wait for response data
+FEED_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+SPOTIFY_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+DNS_CACHE_TTL = 300  # Seconds to keep resolved addresses
+
+# Connections kept open per host; hosts not listed get DEFAULT_POOL_SIZE
+DEFAULT_POOL_SIZE = 2
+DEFAULT_POOL_HOSTS = 20  # Hosts without their own pool that share the default adapter
+POOL_SIZES = {
+    'api.spotify.com': 4,
+    'accounts.spotify.com': 1,
+}
+
+# Only methods that are safe to repeat are retried
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+_dns_cache = {}
+_dns_lock = threading.Lock()
+_original_getaddrinfo = None
+
+
+def _cached_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    """socket.getaddrinfo with results cached for DNS_CACHE_TTL seconds."""
+    key = (host, port, family, type, proto, flags)
+    now = time.monotonic()
+    with _dns_lock:
+        cached = _dns_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+    result = _original_getaddrinfo(host, port, family, type, proto, flags)
+    with _dns_lock:
+        _dns_cache[key] = (now + DNS_CACHE_TTL, result)
+    return result
+
+
+def install_dns_cache():
+    """Cache DNS lookups process-wide. Failed lookups are not cached."""
+    global _original_getaddrinfo
+    if _original_getaddrinfo is None:
+        _original_getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = _cached_getaddrinfo
+
+
+class TunedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that retries idempotent requests and applies default timeouts."""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=FEED_TIMEOUT, hosts=1):
+        self.timeout = timeout
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=2,
+            status=2,
+            backoff_factor=0.3,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=RETRY_METHODS,
+            raise_on_status=False,
+        )
+        super().__init__(pool_connections=hosts, pool_maxsize=pool_size, max_retries=retry)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def mount_host(session, host, pool_size=None):
+    """Give a host its own connection pool of the given size (POOL_SIZES by default)."""
+    if pool_size is None:
+        pool_size = POOL_SIZES.get(host, DEFAULT_POOL_SIZE)
+    adapter = TunedHTTPAdapter(pool_size)
+    session.mount(f'https://{host}', adapter)
+    session.mount(f'http://{host}', adapter)
+    return adapter
+
+
+def create_session():
+    """Create a session with tuned adapters, per-host pools and cached DNS."""
+    install_dns_cache()
+    session = requests.Session()
+    adapter = TunedHTTPAdapter(hosts=DEFAULT_POOL_HOSTS)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    for host in POOL_SIZES:
+        mount_host(session, host)
+    return session
+
+
+def get_session():
+    """Return the session shared by everything in this process."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def reset_session():
+    """Forget the shared session, e.g. in a forked worker process.
+
+    A forked child would otherwise keep using the parent's pooled sockets.
+    The next get_session() creates a fresh session with its own connections.
+    """
+    global _session, _session_lock
+    _session_lock = threading.Lock()  # The parent's lock may have been held while forking
+    _session = None
+
+
+def ensure_host_pool(session, url, pool_size):
+    """Mount a pool of pool_size for the URL's host unless it already has its own."""
+    host = urllib.parse.urlsplit(url).netloc
+    prefix = f'https://{host}' if url.startswith('https') else f'http://{host}'
+    if prefix not in session.adapters:
+        mount_host(session, host, pool_size)
+
+
+def transport_stats(session=None):
+    """Return connection pool statistics per host.
+
+    `connections` counts connections opened, `requests` requests sent. Once
+    connections stop growing while requests keep going up, every request reuses
+    an open connection and no handshakes are left in the steady state.
+    """
+    session = session or _session
+    if session is None:
+        return []
+
+    stats = []
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen or not hasattr(adapter, 'poolmanager'):
+            continue
+        seen.add(id(adapter))
+        for key in list(adapter.poolmanager.pools.keys()):
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            slots = pool.pool
+            # The pool queue holds open idle connections plus None for slots never used
+            idle = sum(1 for conn in list(slots.queue) if conn is not None) if slots is not None else 0
+            stats.append({
+                'host': pool.host,
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                'reuse': round(1 - pool.num_connections / pool.num_requests, 3) if pool.num_requests else None,
+                'pool_size': slots.maxsize if slots is not None else 0,
+                'in_use': slots.maxsize - slots.qsize() if slots is not None else 0,
+                'idle': idle,
+            })
+    return stats
+
+
+def print_transport_stats(session=None):
+    """Print pool utilization and connection reuse per host."""
+    stats = transport_stats(session)
+    if not stats:
+        return
+    print("\nConnection pools:")
+    for entry in stats:
+        reuse = f"{entry['reuse']:.0%}" if entry['reuse'] is not None else "-"
+        print(f"- {entry['host']}: {entry['requests']} requests, {entry['connections']} connections, "
+              f"{reuse} reused, {entry['in_use']}/{entry['pool_size']} in use, {entry['idle']} idle")
+
+
+def log_stats_every(seconds):
+    """Print transport statistics every few seconds in the background."""
+    def run():
+        while True:
+            time.sleep(seconds)
+            print_transport_stats()
+    threading.Thread(target=run, daemon=True).start()
+
+
+def add_arguments(parser):
+    """Add the --transport-stats option to a tracker's argument parser."""
+    parser.add_argument('--transport-stats', type=float, metavar='SECONDS',
+                        help="Print connection pool statistics every SECONDS")
+
+
+def start_from_args(args):
+    """Start printing transport statistics if --transport-stats was given."""
+    if args.transport_stats:
+        log_stats_every(args.transport_stats)